@@ -0,0 +1,81 @@
+"""
+    Description: Check juntek_kg.InfluxSink against a local HTTP stand-in for InfluxDB
+    The stand-in answers 503 to the first two POSTs, then 204, and checks that
+      - batches are gzipped line protocol
+      - precision=ms is added to the write url
+      - the r00 tags are in every line
+      - failed batches are retried and all points arrive, also via close()
+    Usage: python3 influx_check.py [--points 20000]
+"""
+
+import gzip
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import juntek_kg
+
+SETTINGS = {'model': 'KG140F', 'serial_number': '6', 'address': '1'}
+SENSORS = {'current': -53.66, 'voltage': 54.1, 'SoC': 99.3, 'direction': 0, 'time': '2022-10-19T04:00:00+0000'}
+
+
+class InfluxStandIn(BaseHTTPRequestHandler):
+    """ minimal InfluxDB write endpoint """
+    protocol_version = "HTTP/1.1" # keep-alive, like InfluxDB
+    failures = 2
+    paths = []
+    lines = []
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """ store the decoded lines, fail the first requests with 503 """
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if InfluxStandIn.failures > 0:
+            InfluxStandIn.failures -= 1
+            status = 503
+        else:
+            assert self.headers['Content-Encoding'] == "gzip"
+            InfluxStandIn.paths.append(self.path)
+            InfluxStandIn.lines.extend(gzip.decompress(body).decode().splitlines())
+            status = 204
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        """ quiet """
+
+
+def main() -> None:
+    """ run the check """
+    parser = argparse.ArgumentParser(description="Check InfluxSink against a local HTTP stand-in")
+    parser.add_argument("--points", help="points to write, default=20000", type=int, default=20000)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), InfluxStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    url = f"http://127.0.0.1:{server.server_port}/api/v2/write?org=home&bucket=solar"
+    sink = juntek_kg.InfluxSink(url, token="check", batch_size=1000, flush_interval=1)
+    sink.set_tags(SETTINGS)
+
+    start = time.time()
+    for idx in range(args.points):
+        sink.write_sensors(SENSORS, start + idx)
+    elapsed = time.time() - start
+    sink.close()
+    server.shutdown()
+
+    lines = InfluxStandIn.lines
+    assert all(path.endswith("precision=ms") for path in InfluxStandIn.paths), InfluxStandIn.paths
+    assert len(lines) == args.points, f"received {len(lines)} of {args.points} points"
+    assert all(line.startswith("juntek,model=KG140F,serial_number=6,address=1 ") for line in lines), lines[0]
+    assert lines[0].endswith(" " + str(int(start * 1000))), lines[0]
+    assert sink.batches_dropped == 0
+
+    print(f"OK: points={len(lines)}, batches={sink.batches_sent}, {elapsed / args.points * 1e6:.1f}us per point")
+    print(f"line={lines[0]}")
+
+
+if __name__ == "__main__":
+    main()
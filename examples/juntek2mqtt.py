@@ -8,15 +8,16 @@
 """
 
 import os
+import time
 import argparse
 
 import logging
 import json
-import serial
 import paho.mqtt.client as mqtt
 import juntek_kg
 #from elapsed import Elapsed
 import elapsed
+import spool
 
 
 # globals
@@ -24,13 +25,60 @@ instrument = None
 args = None
 logger = None
 mqtt_client = None
-
-def mqtt_publish(topic: str, payload: str, retain: bool = False, wait: bool = False) -> None:
-    """publish payload on mqtt topic"""
+mqtt_connected = False
+mqtt_spool = None
+mqtt_spool_drain_time = 0
+influx_sink = None
+
+def mqtt_publish(topic: str, payload: str, retain: bool = False, qos: int = 0):
+    """publish payload on mqtt topic
+       return MQTTMessageInfo, None if the broker is not available
+    """
     logger.debug("topic=%s, payload=%s", topic, payload)
-    infot = mqtt_client.publish(topic=topic, payload=payload, qos=0, retain=retain)
-    if wait:
-        infot.wait_for_publish()
+    if not mqtt_connected:
+        return None
+    infot = mqtt_client.publish(topic=topic, payload=payload, qos=qos, retain=retain)
+    if infot.rc != mqtt.MQTT_ERR_SUCCESS:
+        return None
+    return infot
+
+def mqtt_confirmed(infots: list) -> bool:
+    """wait up to --mqtt-timeout for QoS 1 messages to be acknowledged by the broker
+       a half-open connection reports rc=success, only the PUBACK proves delivery
+    """
+    deadline = time.time() + args.mqtt_timeout
+    for infot in infots:
+        if infot is None:
+            return False
+        try:
+            infot.wait_for_publish(max(deadline - time.time(), 0.001))
+        except (RuntimeError, ValueError):
+            return False
+        if not infot.is_published():
+            return False
+    return True
+
+def mqtt_publish_backfill(topic: str, sensors: dict, timestamp: float) -> bool:
+    """publish a spooled sensors snapshot as one timestamped JSON payload
+       return True once acknowledged, so the spool only advances past delivered snapshots
+    """
+    infot = mqtt_publish(topic, json.dumps({"timestamp": timestamp, **sensors}), qos=1)
+    return mqtt_confirmed([infot])
+
+def mqtt_drain_spool() -> None:
+    """send spooled messages, at most --spool-rate messages per second"""
+    global mqtt_spool_drain_time
+    if not mqtt_spool or not mqtt_connected or not mqtt_spool.segments:
+        mqtt_spool_drain_time = time.time()
+        return
+    now = time.time()
+    # allow up to 5 seconds of burst
+    max_count = int(min(now - mqtt_spool_drain_time, 5) * args.spool_rate)
+    if max_count < 1:
+        return
+    mqtt_spool_drain_time = now
+    sent = mqtt_spool.drain(mqtt_publish_backfill, max_count)
+    logger.debug("spool sent=%d, backlog_bytes=%d", sent, mqtt_spool.backlog_bytes())
 
 # https://developers.home-assistant.io/docs/core/entity/sensor/#available-device-classes
 DEVICE_CLASS_DICT = {
@@ -104,7 +152,8 @@ def mqtt_publish_hass_discovery(base_topic: str, sensors: dict, settings: dict):
         if device_class:
             discovery_payload["device_class"] = device_class
 
-        logger.info("discovery_topic=%s,\ndiscovery_payload=%s", discovery_topic, json.dumps(discovery_payload,indent=4))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("discovery_topic=%s,\ndiscovery_payload=%s", discovery_topic, json.dumps(discovery_payload,indent=4))
 
         # publish discovery topic & payload with optional retained=True
         # retained=True to make mqtt retain discovery messages on restart
@@ -113,16 +162,23 @@ def mqtt_publish_hass_discovery(base_topic: str, sensors: dict, settings: dict):
 
 
 def mqtt_publish_state(base_topic: str, sensors: dict, settings: dict):
-    """ loop thru sensors and publish via mqtt """
+    """ loop thru sensors and publish via mqtt at QoS 1
+        if the broker does not acknowledge every message within --mqtt-timeout the whole snapshot
+        is spooled for <base_topic>/<device_id>/backfill, old values are never replayed on the live state topics
+    """
     device_id = device_id = settings['model'].lower()
 
+    infots = []
     for key, value in sensors.items():
         state_name = key
         payload = value
         state_topic = base_topic + "/" + device_id + "/" + state_name + "/state"
         logger.info("state_topic=%s, payload=%s", state_topic, payload)
         if args.mqtt:
-            mqtt_publish(state_topic, payload, False)
+            infots.append(mqtt_publish(state_topic, payload, False, qos=1))
+
+    if args.mqtt and mqtt_spool and not mqtt_confirmed(infots):
+        mqtt_spool.append(base_topic + "/" + device_id + "/backfill", sensors)
 
 
 
@@ -133,14 +189,22 @@ def setup_args() -> None:
 
     parser.add_argument("--device", help="RS485 device, e.g. /dev/ttyUSB1", type=str, required=True)
     parser.add_argument("--baudrate", help="RS485 baudrate, default=115200'", type=int, default=115200)
+    parser.add_argument("--serial-timeout", help="RS485 read timeout seconds, default=1", type=float, default=1.0)
     parser.add_argument("--mqtt", help="MQTT enable message publish", action="store_true")
     parser.add_argument("--mqtt-user", help="MQTT username", type=str) # WARNING: passing passwords on cmd line is not secure
     parser.add_argument("--mqtt-password", help="MQTT password", type=str)
     parser.add_argument("--mqtt-broker", help="MQTT broker (server), default localhost", type=str, default="localhost")
     parser.add_argument("--mqtt-port", help="MQTT port, default 1883", type=int, default=1883)
+    parser.add_argument("--mqtt-timeout", help="MQTT seconds to wait for QoS 1 acknowledge before spooling, default=5", type=float, default=5.0)
     parser.add_argument("--mqtt-topic", help="MQTT topic, default 'juntek'", type=str, default="juntek")
     parser.add_argument("--mqtt-hass", help="MQTT enable Home Assistant discovery", action="store_true")
     parser.add_argument("--mqtt-hass-retain", help="MQTT enable retain HASS discovery mesages", action="store_true")
+    parser.add_argument("--spool-dir", help="Directory to spool sensor data while MQTT broker is unavailable", type=str)
+    parser.add_argument("--spool-max-mb", help="Max spool size in MB, oldest data is dropped, default=100", type=int, default=100)
+    parser.add_argument("--spool-rate", help="Spooled snapshots sent per second after reconnect, default=50", type=int, default=50)
+    parser.add_argument("--influx-url", help="InfluxDB write url, e.g. http://localhost:8086/api/v2/write?org=home&bucket=solar", type=str)
+    parser.add_argument("--influx-token", help="InfluxDB token", type=str)
+    parser.add_argument("--influx-frames", help="InfluxDB write every r50 frame, not only the average", action="store_true")
     parser.add_argument("--debug", help="Enable debug output", action="store_true")
     parser.add_argument("--sleep", help="Seconds bettwen sampling loop, default=60", type=int, default=60)
 
@@ -154,22 +218,47 @@ def setup_logger() -> None:
     logger = logging.getLogger(__name__)
     logging.basicConfig(format="%(asctime)s %(levelname)s [%(filename)s:%(lineno)s %(funcName)s()] %(message)s", level=level)
 
-def setup_instrument() -> None:
-    """ Open serial port """
+def setup_instrument(jkg) -> None:
+    """ Open serial port via the link supervisor, which reconnects on stall or error """
     global instrument
-    instrument = serial.Serial( port=args.device, baudrate=args.baudrate ) # timeout(float)
-    logger.info("instrument=%s",instrument)
+    instrument = juntek_kg.LinkSupervisor(jkg, args.device, baudrate=args.baudrate, timeout=args.serial_timeout)
+    logger.info("instrument=%s",instrument.device)
+
+def on_mqtt_connect(client, userdata, flags, rc) -> None: # pylint: disable=unused-argument
+    """ mqtt connect callback """
+    global mqtt_connected
+    mqtt_connected = rc == 0
+    logger.info("mqtt connect rc=%d", rc)
+
+def on_mqtt_disconnect(client, userdata, rc) -> None: # pylint: disable=unused-argument
+    """ mqtt disconnect callback, paho loop thread reconnects """
+    global mqtt_connected
+    mqtt_connected = False
+    logger.warning("mqtt disconnect rc=%d", rc)
 
 def setup_mqtt_client() -> None:
-    """ connect to mqtt """
-    global mqtt_client
+    """ connect to mqtt, runs paho network loop in background thread so it reconnects """
+    global mqtt_client, mqtt_spool
     client_name = os.path.basename(__file__)
     logger.info("setup_mqtt_client: connecting=%s",args.mqtt_broker)
     mqtt_client = mqtt.Client(client_name)
     #mqtt_client.enable_logger(logger)
     mqtt_client.username_pw_set(args.mqtt_user, args.mqtt_password)
-    mqtt_client.connect(args.mqtt_broker, port=args.mqtt_port)
-
+    mqtt_client.on_connect = on_mqtt_connect
+    mqtt_client.on_disconnect = on_mqtt_disconnect
+    mqtt_client.reconnect_delay_set(min_delay=1, max_delay=60)
+    mqtt_client.connect_async(args.mqtt_broker, port=args.mqtt_port)
+    mqtt_client.loop_start()
+    if args.spool_dir:
+        mqtt_spool = spool.Spool(args.spool_dir, max_bytes=args.spool_max_mb*1024*1024)
+        logger.info("spool=%s, backlog_bytes=%d", args.spool_dir, mqtt_spool.backlog_bytes())
+
+
+def setup_influx_sink() -> None:
+    """ start the InfluxDB line protocol sink """
+    global influx_sink
+    logger.info("setup_influx_sink: url=%s", args.influx_url)
+    influx_sink = juntek_kg.InfluxSink(args.influx_url, token=args.influx_token)
 
 def main() -> None:
     """ setup and loop """
@@ -177,11 +266,12 @@ def main() -> None:
 
     setup_args()
     setup_logger()
-    setup_instrument()
+    jkg = juntek_kg.JuntekKG(None)
+    setup_instrument(jkg)
     if args.mqtt:
         setup_mqtt_client()
-    
-    jkg = juntek_kg.JuntekKG(instrument)
+    if args.influx_url:
+        setup_influx_sink()
 
     loop_count = 0
     timer = elapsed.Elapsed(args.sleep)
@@ -189,23 +279,38 @@ def main() -> None:
     # READ LOOOP
     while True:
         line = instrument.readline()
+        r00_message_count = jkg.r00_message_count
+        r50_message_count = jkg.r50_message_count
         jkg.decode_line(line)
+        if influx_sink and r00_message_count == 0 and jkg.r00_message_count == 1:
+            influx_sink.set_tags(jkg.get_settings())
+        # wait for r00 so every point has the model/serial_number/address tags
+        if influx_sink and args.influx_frames and jkg.r00_message_count > 0 and jkg.r50_message_count != r50_message_count:
+            influx_sink.write_sensors({name: jkg.sensor_value(name) for name in jkg.juntek_sensor})
+        if args.mqtt:
+            mqtt_drain_spool()
         if timer.check():
-            sensors = jkg.get_sensors()
-            logger.debug("sensors=%s",json.dumps(sensors, indent=4))
+            snapshot = jkg.get_snapshot()
+            sensors = snapshot.as_dict()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("sensors=%s", snapshot.to_json())
 
             # publish discovery first loop and every 15 loops
             if loop_count % 15 == 0:
                 settings = jkg.get_settings()
-                logger.debug("settings=%s",json.dumps(settings, indent=4))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("settings=%s",json.dumps(settings, indent=4))
                 logger.info("publishing hass discovery")
                 mqtt_publish_hass_discovery(args.mqtt_topic, sensors, settings)
                 
             logger.info("publishing sensor data")
             mqtt_publish_state(args.mqtt_topic, sensors, settings)
+            if influx_sink and not args.influx_frames and jkg.r00_message_count > 0:
+                influx_sink.write_sensors(sensors)
 
             # run maintenance task to check SoC=100 and reset cumulative_Ah, charge_Wh, run_time_record
             jkg.run_maintenance()
+            logger.info("link=%s", instrument.get_link_stats())
             loop_count += 1
             logger.info("============= sleep %d, loop_count=%d, ===========", args.sleep, loop_count)
 
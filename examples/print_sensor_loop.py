@@ -1,6 +1,5 @@
 import logging
 import json
-import serial
 import juntek_kg
 from elapsed import Elapsed
 
@@ -11,9 +10,8 @@ def run_loop(args_port = "/dev/ttyUSB3", args_baudrate = 115200):
     
     logging.basicConfig(format="%(asctime)s %(levelname)s [%(filename)s:%(lineno)s %(funcName)s()] %(message)s", level=logging.DEBUG)
 
-    device = serial.Serial( port=args_port, baudrate=args_baudrate ) # timeout(float)
-
-    jkg = juntek_kg.JuntekKG(device)
+    jkg = juntek_kg.JuntekKG(None)
+    link = juntek_kg.LinkSupervisor(jkg, args_port, baudrate=args_baudrate, timeout=1.0)
 
     loop_count = 0
     elapsed=Elapsed(15)
@@ -21,7 +19,7 @@ def run_loop(args_port = "/dev/ttyUSB3", args_baudrate = 115200):
     # READ LOOOP
     while True:
         loop_count += 1
-        line = device.readline()
+        line = link.readline()
         jkg.decode_line(line)
         if elapsed.check():
             sensors = jkg.get_sensors()
@@ -33,6 +31,7 @@ def run_loop(args_port = "/dev/ttyUSB3", args_baudrate = 115200):
             # send to mqtt
 
             jkg.run_maintenance()
+            print(f"MAIN3: link={link.get_link_stats()}")
 
 
 run_loop()
\ No newline at end of file
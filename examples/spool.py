@@ -0,0 +1,137 @@
+""" Store-and-forward disk spool for MQTT messages """
+import os
+import time
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Spool:
+    """ store-and-forward queue of (topic, payload) messages on disk
+        messages are appended with their capture time as json lines [time, topic, payload]
+        to numbered segment files, eg 000000000001.spool
+        the oldest segment is read first, and deleted once drained
+        when the spool is larger than max_bytes the oldest segments are evicted
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 1024*1024, max_bytes: int = 100*1024*1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.evicted_segments = 0
+        self._writer = None
+        self._writer_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(int(name[:-6]) for name in os.listdir(directory) if name.endswith(".spool"))
+        self.total_bytes = sum(os.path.getsize(self._path(seq)) for seq in self.segments)
+        self._next_seq = self.segments[-1] + 1 if self.segments else 1
+
+        # read position in the oldest segment, saved as "seq offset"
+        self.read_offset = 0
+        try:
+            with open(os.path.join(directory, "offset"), encoding="ascii") as file:
+                seq, offset = file.read().split()
+            if self.segments and int(seq) == self.segments[0]:
+                self.read_offset = int(offset)
+        except (OSError, ValueError):
+            pass
+
+    def _path(self, seq: int) -> str:
+        """ return file name of segment """
+        return os.path.join(self.directory, f"{seq:012d}.spool")
+
+    def _save_offset(self):
+        """ save read position so a restart does not resend messages """
+        path = os.path.join(self.directory, "offset")
+        seq = self.segments[0] if self.segments else 0
+        with open(path + ".tmp", "w", encoding="ascii") as file:
+            file.write(f"{seq} {self.read_offset}\n")
+        os.replace(path + ".tmp", path)
+
+    def _roll(self):
+        """ close the current segment and start a new one """
+        if self._writer:
+            self._writer.close()
+        seq = self._next_seq
+        self._next_seq += 1
+        self.segments.append(seq)
+        self._writer = open(self._path(seq), "ab") # pylint: disable=consider-using-with
+        self._writer_bytes = 0
+
+    def _remove_oldest(self):
+        """ delete the oldest segment """
+        seq = self.segments.pop(0)
+        path = self._path(seq)
+        self.total_bytes -= os.path.getsize(path)
+        if self._writer and not self.segments:
+            self._writer.close()
+            self._writer = None
+        os.remove(path)
+        self.read_offset = 0
+        self._save_offset()
+
+    def append(self, topic: str, payload, timestamp: float = None):
+        """ add message to the spool, evict oldest segments if over max_bytes
+            timestamp: capture time, default now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        line = (json.dumps([timestamp, topic, payload]) + "\n").encode()
+        if self._writer is None or self._writer_bytes >= self.segment_bytes:
+            self._roll()
+        self._writer.write(line)
+        self._writer.flush()
+        self._writer_bytes += len(line)
+        self.total_bytes += len(line)
+
+        while self.total_bytes > self.max_bytes and len(self.segments) > 1:
+            logger.warning("spool full, evicting segment=%d, total_bytes=%d", self.segments[0], self.total_bytes)
+            self._remove_oldest()
+            self.evicted_segments += 1
+
+    def backlog_bytes(self) -> int:
+        """ return bytes waiting to be sent """
+        return self.total_bytes - self.read_offset
+
+    def drain(self, publish, max_count: int) -> int:
+        """ send up to max_count messages, oldest first, via publish(topic, payload, timestamp)
+            stops when publish returns False, the message is kept for the next drain
+            return number of messages sent
+        """
+        sent = 0
+        while sent < max_count and self.segments:
+            seq = self.segments[0]
+            is_writer = self._writer is not None and seq == self.segments[-1]
+            with open(self._path(seq), "rb") as file:
+                file.seek(self.read_offset)
+                for line in file:
+                    if sent >= max_count:
+                        break
+                    if not line.endswith(b"\n"):
+                        if is_writer:
+                            break
+                        # truncated by a crash
+                        self.read_offset += len(line)
+                        continue
+                    try:
+                        timestamp, topic, payload = json.loads(line)
+                    except ValueError:
+                        logger.warning("spool bad line skipped, segment=%d, line=%s", seq, line)
+                        self.read_offset += len(line)
+                        continue
+                    if not publish(topic, payload, timestamp):
+                        self._save_offset()
+                        return sent
+                    self.read_offset += len(line)
+                    sent += 1
+                size = file.seek(0, os.SEEK_END)
+
+            if self.read_offset < size:
+                break
+            # segment fully sent
+            self._remove_oldest()
+
+        if sent:
+            self._save_offset()
+        return sent
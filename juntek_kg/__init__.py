@@ -2,3 +2,5 @@
 # required for pip
 
 from .juntek_kg import *
+from .influx import InfluxSink
+from .link import LinkSupervisor
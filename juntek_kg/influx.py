@@ -0,0 +1,201 @@
+""" InfluxDB line protocol sink
+
+    Turns get_sensors() dicts into line protocol, eg
+        juntek,model=KG140F,serial_number=6 voltage=54.1,current=-53.66 1666152000000
+    Lines are batched by count and time, each batch is gzipped and POSTed by a
+    background thread over a persistent HTTP connection, retrying with backoff.
+    url is the full write endpoint, eg
+        InfluxDB 2: http://localhost:8086/api/v2/write?org=home&bucket=solar
+        InfluxDB 1: http://localhost:8086/write?db=solar
+"""
+
+import time
+import gzip
+import queue
+import logging
+import threading
+import http.client
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+def escape_tag(value) -> str:
+    """escape a line protocol tag key/value"""
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+class InfluxSink:
+    """ Batched InfluxDB line protocol writer """
+
+    # pylint: disable=too-many-instance-attributes, too-many-arguments
+    def __init__(self, url: str, token: str = None, measurement: str = "juntek",
+                 batch_size: int = 5000, flush_interval: float = 10.0,
+                 max_batches: int = 100, max_retries: int = 5, timeout: float = 10.0):
+        """ batch_size     - lines per POST
+            flush_interval - max seconds a line waits before POST
+            max_batches    - batches queued for sending, oldest dropped when full
+            max_retries    - retries per batch before it is dropped
+        """
+        parsed = urllib.parse.urlsplit(url)
+        query = urllib.parse.parse_qs(parsed.query)
+        query['precision'] = ['ms'] # timestamps are written in ms
+        self.path = (parsed.path or "/") + "?" + urllib.parse.urlencode(query, doseq=True)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.https = parsed.scheme == "https"
+        self.timeout = timeout
+        self.headers = {"Content-Type": "text/plain; charset=utf-8",
+                        "Content-Encoding": "gzip"}
+        if token:
+            self.headers["Authorization"] = "Token " + token
+
+        self.measurement = measurement
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.prefix = escape_tag(measurement) + " "
+        self.points_sent = 0
+        self.batches_sent = 0
+        self.batches_dropped = 0
+
+        self._lines = []
+        self._lines_time = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max_batches)
+        self._connection = None
+        self._closed = False
+        self._close_deadline = None
+        self._thread = threading.Thread(target=self._run, name="InfluxSink", daemon=True)
+        self._thread.start()
+
+    def set_tags(self, settings: dict, names=('model', 'serial_number', 'address')):
+        """ precompute measurement,tags prefix from JuntekKG.get_settings() r00 values """
+        tags = "".join("," + escape_tag(name) + "=" + escape_tag(settings[name])
+                       for name in names if settings.get(name) not in (None, ""))
+        self.prefix = escape_tag(self.measurement) + tags + " "
+
+    def write_sensors(self, sensors: dict, timestamp: float = None):
+        """ add one point, numeric values of sensors become float fields
+            timestamp: time.time() seconds, default now
+        """
+        fields = ",".join(name + "=" + repr(float(value)) for name, value in sensors.items()
+                          if isinstance(value, (int, float)) and not isinstance(value, bool))
+        if not fields:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        self.write_line(self.prefix + fields + " " + str(int(timestamp * 1000)))
+
+    def write_line(self, line: str):
+        """ add a line protocol line to the batch """
+        with self._lock:
+            if not self._lines:
+                self._lines_time = time.time()
+            self._lines.append(line)
+            if len(self._lines) < self.batch_size:
+                return
+            lines = self._lines
+            self._lines = []
+        self._enqueue(lines)
+
+    def flush(self):
+        """ queue the pending lines for sending """
+        with self._lock:
+            lines = self._lines
+            self._lines = []
+        if lines:
+            self._enqueue(lines)
+
+    def close(self, timeout: float = 30.0):
+        """ flush, wait up to timeout for queued batches to be sent and stop the thread
+            batches keep their normal retries until the timeout expires
+        """
+        self.flush()
+        self._close_deadline = time.time() + timeout
+        self._closed = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass # the sender thread also stops when it finds the queue empty
+        self._thread.join(max(self._close_deadline - time.time(), 0))
+
+    def _enqueue(self, lines: list):
+        """ queue a batch, dropping the oldest if the queue is full """
+        while True:
+            try:
+                self._queue.put_nowait(lines)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.batches_dropped += 1
+                    logger.warning("influx queue full, batch dropped, batches_dropped=%d", self.batches_dropped)
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        """ sender thread: POST queued batches, flush pending lines every flush_interval
+            only this thread uses and closes the connection
+        """
+        while True:
+            try:
+                lines = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._closed:
+                    break
+                with self._lock:
+                    due = self._lines and time.time() - self._lines_time >= self.flush_interval
+                if due:
+                    self.flush()
+                continue
+            if lines is None:
+                if self._closed and self._queue.empty():
+                    break
+                continue
+            self._send(lines)
+
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        """ return the persistent connection """
+        if self._connection is None:
+            if self.https:
+                self._connection = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+            else:
+                self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._connection
+
+    def _send(self, lines: list):
+        """ POST one gzipped batch, retry with exponential backoff """
+        body = gzip.compress(("\n".join(lines) + "\n").encode(), compresslevel=1)
+        delay = 1
+        for retry in range(self.max_retries + 1):
+            try:
+                connection = self._connect()
+                connection.request("POST", self.path, body=body, headers=self.headers)
+                response = connection.getresponse()
+                text = response.read()
+                if response.status < 300:
+                    self.points_sent += len(lines)
+                    self.batches_sent += 1
+                    logger.debug("influx sent points=%d, bytes=%d", len(lines), len(body))
+                    return
+                logger.warning("influx write status=%d, retry=%d, response=%s", response.status, retry, text[:200])
+                if response.status != 429 and response.status < 500:
+                    break # bad data, retry will not help
+            except (OSError, http.client.HTTPException) as error:
+                logger.warning("influx write error=%s, retry=%d", error, retry)
+                if self._connection:
+                    self._connection.close()
+                self._connection = None
+            if retry == self.max_retries:
+                break
+            if self._close_deadline is not None and time.time() + delay > self._close_deadline:
+                break # close() timeout
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+        self.batches_dropped += 1
+        logger.error("influx batch dropped, points=%d, batches_dropped=%d", len(lines), self.batches_dropped)
@@ -29,6 +29,8 @@ import logging
 
 # utility functions/classes
 from .movingavg import MovingAvg
+from .quantile import QuantileSketch
+from .snapshot import SnapshotLayout, Snapshot
 from .iround import iround
 
 logger = logging.getLogger(__name__)
@@ -63,12 +65,55 @@ JUNTEK_R50_DICT = {
    'time':                       {'idx':110,'unit':'tm',  'factor':'tm'},    # 110
 }
 
+# precompiled field order & JSON/binary templates for Snapshot
+JUNTEK_R50_LAYOUT = SnapshotLayout(JUNTEK_R50_DICT)
+
+# fixed_point mode: sensors are kept as integers in the meter's native units
+#   value = int / scale, applied only in get_sensors()
+#   power = centiamps * centivolts, energy = mAh * centivolts, SoC = 0.1%
+JUNTEK_R50_FIXED_SCALE = {
+   'current':                    100,    # cA
+   'voltage':                    100,    # cV
+   'capacity_Ah':                1000,   # mAh
+   'cumulative_Ah':              1000,   # mAh
+   'charge_Wh':                  100,    # cWh
+   'run_time_record':            1,
+   'temperature':                1,
+   'relay_state':                1,
+   'direction':                  1,
+   'battery_time_left':          1,
+   'battery_internal_resistance':100,
+   'power':                      10000,  # cA * cV
+   'power_in':                   10000,
+   'power_out':                  10000,
+   'SoC':                        10,     # 0.1%
+   'preset_battery_capacity_Ah': 10,     # dAh
+   'energy_in':                  100000, # mAh * cV
+   'energy_out':                 100000,
+   'energy_today_in':            100000,
+   'energy_today_out':           100000,
+}
+
+# (name, idx, factor) of the sensors read from the r50 message
+JUNTEK_R50_FIELDS = [(name, value['idx'], value['factor']) for name, value in JUNTEK_R50_DICT.items() if value['idx'] < 100]
+
 # Limits to check before clear accumulated data
 #  - cumulative_Ah, charge_Wh, run_time_record
 # These limits are for Hubble Lithium AM2
 LIMIT_VOLT = 53.4
 LIMIT_SOC = 99.9
 
+# Time buckets for the optional per sensor quantile sketches (seconds)
+QUANTILE_PERIODS = {
+   'hour': 3600,
+   'day':  86400,
+}
+
+def quantile_bucket_start(now: float, seconds: int) -> float:
+    """return start of the local time bucket containing now"""
+    offset = time.localtime(now).tm_gmtoff
+    return now - (now + offset) % seconds
+
 def calculate_checksum(line_list: list) -> int:
     """
     From the manual: (4) Checksum:
@@ -114,6 +159,12 @@ def scale_sensor(factor: str, sensor: str):
         return round(int(sensor) - 100, 0) #
     return int(sensor)
 
+def fixed_sensor(factor: str, sensor: str) -> int:
+    """return sensor as int in the meter's native units"""
+    if factor == 'f-100':
+        return int(sensor) - 100
+    return int(sensor)
+
 def iround_sensor(factor: str, sensor: float):
     """return factor(sensor)"""
     if sensor is None:
@@ -194,7 +245,13 @@ class JuntekKG:
 
     # pylint: disable=too-many-instance-attributes
     # Nine is reasonable in this case.
-    def __init__(self, device):
+    def __init__(self, device, quantile_sensors=(), quantile_periods=('hour', 'day'), quantile_accuracy=0.01,
+                 fixed_point: bool = False):
+        """ quantile_sensors: optional list of numeric JUNTEK_R50_DICT names, eg ['current','power']
+                              to track p50/p95/p99 per quantile_periods bucket, ValueError if unknown
+            fixed_point: keep sensors & energy as integers (see JUNTEK_R50_FIXED_SCALE),
+                         converted to float only in get_sensors()
+        """
         self.juntek_setting = {} # dict()
         self.juntek_sensor = {} # dict()
         self.juntek_sensor_av = {} # dict()
@@ -206,6 +263,24 @@ class JuntekKG:
         self.prev_cumulative_Ah = 0
         self.start_time = time.time()
         self.device = device
+        self.fixed_point = fixed_point
+        self.quantile_sensors = tuple(quantile_sensors)
+        self.quantile_periods = tuple(quantile_periods)
+        numeric_sensors = [name for name, value in JUNTEK_R50_DICT.items() if value['factor'] != 'tm']
+        for name in self.quantile_sensors:
+            if name not in numeric_sensors:
+                raise ValueError(f"quantile_sensors: unknown sensor '{name}', use one of {numeric_sensors}")
+        for period in self.quantile_periods:
+            if period not in QUANTILE_PERIODS:
+                raise ValueError(f"quantile_periods: unknown period '{period}', use one of {list(QUANTILE_PERIODS)}")
+        if not 0 < quantile_accuracy < 1:
+            raise ValueError(f"quantile_accuracy: {quantile_accuracy} must be between 0 and 1")
+        self.quantile_accuracy = quantile_accuracy
+        self.juntek_sensor_qs = {}       # {period: {name: QuantileSketch}} current bucket
+        self.juntek_sensor_qs_prev = {}  # {period: {name: QuantileSketch}} last completed bucket
+        self.juntek_sensor_qs_start = {} # {period: bucket start time}
+        self.juntek_sensor_qs_prev_start = {}
+        self.juntek_sensor_qs_end = {}   # {period: bucket end time}
 
 
     def get_settings(self):
@@ -239,7 +314,10 @@ class JuntekKG:
         result = {}
         for name, mv_avg in self.juntek_sensor_av.items():
             factor = JUNTEK_R50_DICT[name]['factor']
-            result[name] = iround_sensor(factor, mv_avg.avg())
+            if self.fixed_point:
+                result[name] = iround_sensor(factor, mv_avg.avg() / JUNTEK_R50_FIXED_SCALE[name])
+            else:
+                result[name] = iround_sensor(factor, mv_avg.avg())
 
         #result.update(self.calculate_energy())
 
@@ -249,6 +327,73 @@ class JuntekKG:
         return result
 
 
+    def get_snapshot(self) -> Snapshot:
+        """ return moving average of sensors as a Snapshot, cheaper than get_sensors()
+            rounding & formatting is done by Snapshot.as_dict()/to_json()/to_bytes()
+            sets count_batch = 0 which on next decode_line resets the average
+        """
+        values = [None] * len(JUNTEK_R50_LAYOUT.names)
+        for name, mv_avg in self.juntek_sensor_av.items():
+            if self.fixed_point:
+                values[JUNTEK_R50_LAYOUT.index[name]] = mv_avg.avg() / JUNTEK_R50_FIXED_SCALE[name]
+            else:
+                values[JUNTEK_R50_LAYOUT.index[name]] = mv_avg.avg()
+        self.r50_message_count_batch = 0
+        return Snapshot(JUNTEK_R50_LAYOUT, values, time.time())
+
+
+    def update_quantiles(self):
+        """ add the latest sensor values to the quantile sketches
+            on bucket roll over the sketch is kept as previous and a new one started
+        """
+        now = time.time()
+        for period in self.quantile_periods:
+            if now >= self.juntek_sensor_qs_end.get(period, 0):
+                seconds = QUANTILE_PERIODS[period]
+                start = quantile_bucket_start(now, seconds)
+                if period in self.juntek_sensor_qs:
+                    self.juntek_sensor_qs_prev[period] = self.juntek_sensor_qs[period]
+                    self.juntek_sensor_qs_prev_start[period] = self.juntek_sensor_qs_start[period]
+                self.juntek_sensor_qs[period] = {name: QuantileSketch(self.quantile_accuracy) for name in self.quantile_sensors}
+                self.juntek_sensor_qs_start[period] = start
+                self.juntek_sensor_qs_end[period] = start + seconds
+
+            for name, sketch in self.juntek_sensor_qs[period].items():
+                sketch.next(self.sensor_value(name))
+
+
+    def get_quantiles(self, quantiles=(0.5, 0.95, 0.99), previous: bool = False):
+        """ return {period: {name: {'p50': value, ...}}} of the current (or previous) bucket """
+        sketches = self.juntek_sensor_qs_prev if previous else self.juntek_sensor_qs
+        result = {}
+        for period, sensors in sketches.items():
+            result[period] = {}
+            for name, sketch in sensors.items():
+                factor = JUNTEK_R50_DICT[name]['factor']
+                result[period][name] = {f"p{iround(q * 100, 1)}": iround_sensor(factor, sketch.quantile(q)) for q in quantiles}
+        return result
+
+
+    def get_quantile_sketches(self, previous: bool = False):
+        """ return {period: {'start': time, 'sensors': {name: sketch dict}}} for saving/merging
+            use QuantileSketch.from_dict() to load
+        """
+        sketches = self.juntek_sensor_qs_prev if previous else self.juntek_sensor_qs
+        starts = self.juntek_sensor_qs_prev_start if previous else self.juntek_sensor_qs_start
+        result = {}
+        for period, sensors in sketches.items():
+            result[period] = {'start': time.strftime('%FT%T%z', time.localtime(starts[period])),
+                              'sensors': {name: sketch.to_dict() for name, sketch in sensors.items()}}
+        return result
+
+
+    def sensor_value(self, name: str):
+        """ return latest value of sensor in float units (A, V, ...) """
+        if self.fixed_point:
+            return self.juntek_sensor[name] / JUNTEK_R50_FIXED_SCALE[name]
+        return self.juntek_sensor[name]
+
+
     def zero_sensor_av(self):
         """ zeros the sensor moving average """
         for name in self.juntek_sensor:
@@ -268,10 +413,11 @@ class JuntekKG:
         self.r50_message_count_batch += 1
 
         # decode real sensors
-        for name, value in JUNTEK_R50_DICT.items():
-            idx = value['idx']
-            if idx < 100:
-                factor = value['factor']
+        if self.fixed_point:
+            for name, idx, factor in JUNTEK_R50_FIELDS:
+                self.juntek_sensor[name] = fixed_sensor(factor, line_list[idx])
+        else:
+            for name, idx, factor in JUNTEK_R50_FIELDS:
                 self.juntek_sensor[name] = scale_sensor(factor, line_list[idx])
 
         # On first message, initialise moving columb counter
@@ -282,26 +428,40 @@ class JuntekKG:
             self.juntek_sensor['energy_today_in'] = 0
             self.juntek_sensor['energy_today_out'] = 0
 
+        # energy since the previous message
         energy_delta = (self.juntek_sensor['cumulative_Ah'] - self.prev_cumulative_Ah) * self.juntek_sensor['voltage']
+        self.prev_cumulative_Ah = self.juntek_sensor['cumulative_Ah']
 
         # computed sensors
         if self.juntek_sensor['direction'] == 0:
             # Discharge
-            self.juntek_sensor['current']   = -self.juntek_sensor['current']
-            self.juntek_sensor['power_out'] = round(self.juntek_sensor['current'] * self.juntek_sensor['voltage'],3) # 102
+            self.juntek_sensor['current'] = -self.juntek_sensor['current']
+        power = self.juntek_sensor['current'] * self.juntek_sensor['voltage']
+        if not self.fixed_point:
+            power = round(power,3)
+
+        if self.juntek_sensor['direction'] == 0:
+            # Discharge
+            self.juntek_sensor['power_out'] = power # 102
             self.juntek_sensor['power_in']  = 0
             self.juntek_sensor['energy_out'] -= energy_delta
             self.juntek_sensor['energy_today_out'] -= energy_delta
         if self.juntek_sensor['direction'] == 1:
             # Charge
             self.juntek_sensor['power_out'] = 0
-            self.juntek_sensor['power_in']  = round(self.juntek_sensor['current'] * self.juntek_sensor['voltage'],3) # 101
+            self.juntek_sensor['power_in']  = power # 101
             self.juntek_sensor['energy_in'] += energy_delta
             self.juntek_sensor['energy_today_in'] += energy_delta
 
-        self.juntek_sensor['power'] = round(self.juntek_sensor['current'] * self.juntek_sensor['voltage'],3) # 100
-        self.juntek_sensor['preset_battery_capacity_Ah'] = self.juntek_setting['preset_battery_capacity_Ah']
-        self.juntek_sensor['SoC'] = round(100 * self.juntek_sensor['capacity_Ah'] / self.juntek_sensor['preset_battery_capacity_Ah'],1) # (10) SoC
+        self.juntek_sensor['power'] = power # 100
+        if self.fixed_point:
+            # SoC% = mAh / dAh, in 0.1% rounded
+            preset_dAh = self.juntek_setting['preset_battery_capacity_dAh']
+            self.juntek_sensor['preset_battery_capacity_Ah'] = preset_dAh
+            self.juntek_sensor['SoC'] = (20 * self.juntek_sensor['capacity_Ah'] + preset_dAh) // (2 * preset_dAh) # (10) SoC
+        else:
+            self.juntek_sensor['preset_battery_capacity_Ah'] = self.juntek_setting['preset_battery_capacity_Ah']
+            self.juntek_sensor['SoC'] = round(100 * self.juntek_sensor['capacity_Ah'] / self.juntek_sensor['preset_battery_capacity_Ah'],1) # (10) SoC
 
         # On first message, initialise moving average
         if self.r50_message_count_batch == 1:
@@ -311,6 +471,9 @@ class JuntekKG:
         for name, value in self.juntek_sensor.items():
             self.juntek_sensor_av[name].next(value)
 
+        if self.quantile_sensors:
+            self.update_quantiles()
+
 
     def decode_r00_model(self, line_list: list):
         """ Decode r00 model messages
@@ -351,6 +514,7 @@ class JuntekKG:
         self.juntek_setting['protection_recovery_time_S']         = int(line_list[8])
         self.juntek_setting['delay_time_S']                       = int(line_list[9])
         self.juntek_setting['preset_battery_capacity_Ah']         = float(line_list[10]) / 10
+        self.juntek_setting['preset_battery_capacity_dAh']        = int(line_list[10])
         self.juntek_setting['voltage_calibration']                = float(line_list[11]) - 100
         self.juntek_setting['current_calibration']                = float(line_list[12]) - 100
         self.juntek_setting['temperature_calibration']            = float(line_list[13]) - 100
@@ -359,7 +523,10 @@ class JuntekKG:
         #self.juntek_setting['current_ratio']                      = int("-1")
         self.juntek_setting['voltage_curve_scale']                = int(line_list[16])
 
-        self.juntek_sensor['preset_battery_capacity_Ah'] = self.juntek_setting['preset_battery_capacity_Ah']
+        if self.fixed_point:
+            self.juntek_sensor['preset_battery_capacity_Ah'] = self.juntek_setting['preset_battery_capacity_dAh']
+        else:
+            self.juntek_sensor['preset_battery_capacity_Ah'] = self.juntek_setting['preset_battery_capacity_Ah']
 
 
     def decode_line(self, line: str):
@@ -404,11 +571,14 @@ class JuntekKG:
                      checked > 3              # for 3 minutes
                          clear accumulated data in the device
         """
-        if self.juntek_sensor["voltage"] >= LIMIT_VOLT and self.juntek_sensor['SoC'] >= LIMIT_SOC and (0 <= self.juntek_sensor['curent'] <= 20):
+        voltage = self.sensor_value('voltage')
+        current = self.sensor_value('current')
+        SoC = self.sensor_value('SoC')
+        if voltage >= LIMIT_VOLT and SoC >= LIMIT_SOC and (0 <= current <= 20):
             self.soc_at_100_count += 1
             logger.info("JUNTEK SOC HAS REACHED %f%%, soc_at_100_count=%d, Volts=%f>=%f AND Amps=%f in 0..20, capacity_Ah=%f, SoC=%f>=%f",
-                        self.juntek_sensor['SoC'], self.soc_at_100_count, self.juntek_sensor['voltage'], LIMIT_VOLT,
-                        self.juntek_sensor['current'], self.juntek_sensor['capacity_Ah'], self.juntek_sensor['SoC'], LIMIT_SOC)
+                        SoC, self.soc_at_100_count, voltage, LIMIT_VOLT,
+                        current, self.sensor_value('capacity_Ah'), SoC, LIMIT_SOC)
             if self.soc_at_100_count > 3:
                 set_clear_accumulated_data(self.device)
                 set_recording(self.device,True)
@@ -0,0 +1,202 @@
+""" Serial link supervisor
+
+    Wraps the RS485 device of a JuntekKG:
+      - opens the port with a read timeout so readline() can not hang forever
+      - learns the interval between frames of each message type (:r50=, :r51=, ...)
+      - flags a stall when no frame arrived for stall_frames of the fastest interval,
+        for as long as the link stays silent
+      - on stall or serial error reopens the port with exponential backoff,
+        kept across reconnects until a frame arrives, and re-queries r00/r51 settings
+      - keeps uptime, reconnect count and time to recover
+    All timing uses time.monotonic(), so NTP steps of the wall clock do not fake or hide a stall.
+"""
+
+import time
+import logging
+
+from .iround import iround
+
+logger = logging.getLogger(__name__)
+
+def open_serial(port: str, baudrate: int, timeout: float):
+    """ open pyserial port, pyserial is only needed when the supervisor opens the port """
+    import serial # pylint: disable=import-outside-toplevel
+    return serial.Serial(port=port, baudrate=baudrate, timeout=timeout)
+
+
+class LinkSupervisor:
+    """ Serial link health monitor with stall detection and auto-reconnect """
+
+    # pylint: disable=too-many-instance-attributes, too-many-arguments
+    def __init__(self, jkg, port: str, baudrate: int = 115200, timeout: float = 1.0,
+                 stall_frames: int = 3, min_stall: float = 2.0, fallback_interval: float = 10.0,
+                 min_backoff: float = 1.0, max_backoff: float = 60.0, open_device=open_serial):
+        """ jkg          - JuntekKG, jkg.device is set on every (re)open
+            timeout      - serial read timeout (seconds)
+            stall_frames - missed frames of the fastest message type before reconnect
+            min_stall    - min seconds of silence before reconnect
+            fallback_interval - expected seconds between frames until an interval is learned
+            open_device  - open_device(port, baudrate, timeout) returns the device
+        """
+        self.jkg = jkg
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.stall_frames = stall_frames
+        self.min_stall = min_stall
+        self.fallback_interval = fallback_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.open_device = open_device
+        self.device = None
+
+        self.interval = {}   # {cmd: average seconds between frames}
+        self.last_seen = {}  # {cmd: time of last frame}, cleared on open
+        self.seen_count = {} # {cmd: frames}
+        self.last_frame = time.monotonic()
+        self.connected_since = None
+        self.down_since = None
+        self.reconnect_count = 0
+        self.stall_count = 0
+        self.error_count = 0
+        self.time_to_recover = []  # seconds, last 100 recoveries
+        self._partial = b""
+        self._backoff = 0 # seconds to wait before the next reopen, 0 after a good frame
+
+        self.open()
+
+    def open(self) -> bool:
+        """ open the port, return False on error """
+        try:
+            self.device = self.open_device(self.port, self.baudrate, self.timeout)
+            self.device.reset_input_buffer()
+        except OSError as error:
+            logger.warning("link open failed port=%s, error=%s", self.port, error)
+            self.device = None
+            return False
+        self.jkg.device = self.device
+        self.connected_since = time.monotonic()
+        self.last_frame = self.connected_since
+        # the first frame after (re)open must not average the outage gap into the interval
+        self.last_seen = {}
+        self._partial = b""
+        logger.info("link open port=%s", self.port)
+        return True
+
+    def close(self):
+        """ close the port, ignoring errors """
+        if self.device:
+            try:
+                self.device.close()
+            except OSError:
+                pass
+        self.device = None
+        self.connected_since = None
+
+    def query_settings(self):
+        """ ask the meter for r00 model & r51 settings, replies are read by readline() """
+        address = int(self.jkg.juntek_setting.get('address') or 1)
+        try:
+            self.device.write(b':R00=%d,2,1,\r\n' % address)
+            self.device.write(b':R51=%d,2,1,\r\n' % address)
+        except OSError as error:
+            logger.warning("link query_settings error=%s", error)
+
+    def reconnect(self):
+        """ reopen the port with exponential backoff, blocks until open
+            the backoff grows across failed opens and stall reconnects, _frame() resets it
+        """
+        if self.down_since is None:
+            self.down_since = self.last_frame
+        self.close()
+        while True:
+            if self._backoff:
+                time.sleep(self._backoff)
+            self._backoff = min(max(self._backoff * 2, self.min_backoff), self.max_backoff)
+            if self.open():
+                break
+        self.reconnect_count += 1
+        self.query_settings()
+
+    def expected_interval(self) -> float:
+        """ return interval of the fastest message type still being received
+            a type that stopped while others continue is ignored, if all stopped
+            the fastest learned interval is used, fallback_interval if none learned
+        """
+        now = time.monotonic()
+        learned = {cmd: interval for cmd, interval in self.interval.items() if self.seen_count[cmd] >= 3}
+        active = [interval for cmd, interval in learned.items() if now - self.last_seen.get(cmd, 0) < 20 * interval]
+        if active:
+            return min(active)
+        if learned:
+            return min(learned.values())
+        return self.fallback_interval
+
+    def is_stalled(self) -> bool:
+        """ check if no frame arrived within stall_frames * expected interval """
+        interval = self.expected_interval()
+        return time.monotonic() - self.last_frame > max(self.stall_frames * interval, self.min_stall)
+
+    def _frame(self, line: bytes):
+        """ update per message type interval with a received frame """
+        now = time.monotonic()
+        cmd = line[:5]
+        if cmd in self.last_seen:
+            delta = now - self.last_seen[cmd]
+            if cmd in self.interval:
+                self.interval[cmd] = 0.9 * self.interval[cmd] + 0.1 * delta
+            else:
+                self.interval[cmd] = delta
+        self.last_seen[cmd] = now
+        self.seen_count[cmd] = self.seen_count.get(cmd, 0) + 1
+        self.last_frame = now
+        self._backoff = 0
+
+        if self.down_since is not None:
+            recover = now - self.down_since
+            self.time_to_recover = self.time_to_recover[-99:] + [recover]
+            self.down_since = None
+            logger.info("link recovered, time_to_recover=%.1fs, reconnect_count=%d", recover, self.reconnect_count)
+
+    def readline(self) -> bytes:
+        """ return next complete line, b'' on timeout
+            reconnects on serial error or stall
+        """
+        if self.device is None:
+            self.reconnect()
+        try:
+            line = self.device.readline()
+        except OSError as error:
+            self.error_count += 1
+            logger.warning("link read error=%s, reconnecting", error)
+            self.reconnect()
+            return b""
+
+        if line:
+            # timeout can return a partial line, keep it for the next read
+            line = self._partial + line
+            if not line.endswith(b"\n"):
+                self._partial = line[-1024:]
+                line = b""
+            else:
+                self._partial = b""
+                self._frame(line)
+                return line
+
+        if self.is_stalled():
+            self.stall_count += 1
+            logger.warning("link stalled, no frame for %.1fs, reconnecting", time.monotonic() - self.last_frame)
+            self.reconnect()
+        return line
+
+    def get_link_stats(self) -> dict:
+        """ return link health counters """
+        now = time.monotonic()
+        return {'connected': self.device is not None,
+                'uptime_S': iround(now - self.connected_since, 0) if self.connected_since else 0,
+                'reconnect_count': self.reconnect_count,
+                'stall_count': self.stall_count,
+                'error_count': self.error_count,
+                'last_time_to_recover_S': iround(self.time_to_recover[-1], 1) if self.time_to_recover else None,
+                'max_time_to_recover_S': iround(max(self.time_to_recover), 1) if self.time_to_recover else None,
+                'interval_S': {cmd.decode(errors="replace"): iround(interval, 2) for cmd, interval in self.interval.items()}}
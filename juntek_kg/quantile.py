@@ -0,0 +1,171 @@
+""" Mergeable streaming quantile sketch
+
+    Log-bucket histogram (DDSketch style): each value is counted in the bucket
+    ceil(log(|value|) / log(gamma)), so any quantile is returned within
+    relative_accuracy of the true value. Memory is bounded by max_bins per sign,
+    when exceeded the buckets closest to zero are collapsed together.
+    Sketches with the same relative_accuracy can be merged, eg hours into a day
+    or several meters into one.
+"""
+import math
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 512, min_value: float = 1e-3):
+        """Create QuantileSketch
+            relative_accuracy - quantile error relative to the value, eg 0.01 = 1%
+            max_bins          - max buckets kept for positive and for negative values
+            min_value         - |value| below this is counted as zero
+        """
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.min_value = min_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._multiplier = 1 / math.log(self._gamma)
+        self._pos = {} # bucket: count
+        self._neg = {} # bucket: count
+        self._zero = 0
+        self._count = 0
+        self._sum = 0
+        self._min = 0
+        self._max = 0
+
+    def reset(self):
+        """Reset QuantileSketch, keeps the accuracy settings"""
+        self.__init__(self.relative_accuracy, self.max_bins, self.min_value)
+
+    def next(self, value):
+        """add a value to QuantileSketch"""
+        if self._count == 0:
+            self._min = self._max = value
+        elif value > self._max:
+            self._max = value
+        elif value < self._min:
+            self._min = value
+        self._sum += value
+        self._count += 1
+
+        if value > self.min_value:
+            bins = self._pos
+            key = math.ceil(math.log(value) * self._multiplier)
+        elif value < -self.min_value:
+            bins = self._neg
+            key = math.ceil(math.log(-value) * self._multiplier)
+        else:
+            self._zero += 1
+            return
+
+        if key in bins:
+            bins[key] += 1
+        else:
+            bins[key] = 1
+            if len(bins) > self.max_bins:
+                self._collapse(bins)
+
+    def _collapse(self, bins: dict):
+        """merge the buckets closest to zero until len(bins) <= max_bins"""
+        keys = sorted(bins)
+        excess = len(keys) - self.max_bins
+        total = 0
+        for key in keys[:excess]:
+            total += bins.pop(key)
+        bins[keys[excess]] += total
+
+    def _value(self, key: int) -> float:
+        """return the representative value of a bucket"""
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def quantile(self, q: float):
+        """Return the value at quantile q (0..1), None if empty"""
+        if self._count == 0:
+            return None
+        rank = q * (self._count - 1)
+
+        seen = 0
+        value = None
+        # most negative first
+        for key in sorted(self._neg, reverse=True):
+            seen += self._neg[key]
+            if seen > rank:
+                value = -self._value(key)
+                break
+        if value is None:
+            seen += self._zero
+            if seen > rank:
+                value = 0
+        if value is None:
+            for key in sorted(self._pos):
+                seen += self._pos[key]
+                if seen > rank:
+                    value = self._value(key)
+                    break
+        if value is None:
+            value = self._max
+
+        # bucket values may fall just outside the real range
+        return min(max(value, self._min), self._max)
+
+    def merge(self, other: 'QuantileSketch'):
+        """add the values of other QuantileSketch into this one"""
+        if other._gamma != self._gamma:
+            raise ValueError("QuantileSketch merge: relative_accuracy does not match")
+        if other._count == 0:
+            return
+        if self._count == 0:
+            self._min, self._max = other._min, other._max
+        else:
+            self._min = min(self._min, other._min)
+            self._max = max(self._max, other._max)
+        self._count += other._count
+        self._sum += other._sum
+        self._zero += other._zero
+        for bins, other_bins in ((self._pos, other._pos), (self._neg, other._neg)):
+            for key, count in other_bins.items():
+                bins[key] = bins.get(key, 0) + count
+            if len(bins) > self.max_bins:
+                self._collapse(bins)
+
+    def to_dict(self) -> dict:
+        """Return a json friendly dict of the sketch"""
+        return {'relative_accuracy': self.relative_accuracy,
+                'max_bins': self.max_bins,
+                'min_value': self.min_value,
+                'count': self._count,
+                'sum': self._sum,
+                'min': self._min,
+                'max': self._max,
+                'zero': self._zero,
+                'pos': {str(key): count for key, count in self._pos.items()},
+                'neg': {str(key): count for key, count in self._neg.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'QuantileSketch':
+        """Create a QuantileSketch from to_dict() output"""
+        sketch = cls(data['relative_accuracy'], data['max_bins'], data['min_value'])
+        sketch._count = data['count']
+        sketch._sum = data['sum']
+        sketch._min = data['min']
+        sketch._max = data['max']
+        sketch._zero = data['zero']
+        sketch._pos = {int(key): count for key, count in data['pos'].items()}
+        sketch._neg = {int(key): count for key, count in data['neg'].items()}
+        return sketch
+
+    def sum(self):
+        """Return the sum"""
+        return self._sum
+
+    def min(self):
+        """Return the min"""
+        return self._min
+
+    def max(self):
+        """Return the max"""
+        return self._max
+
+    def count(self):
+        """Return the count"""
+        return self._count
+
+
+if __name__ == "__main__":
+    print("Quantile Sketch")
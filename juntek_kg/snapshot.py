@@ -0,0 +1,96 @@
+""" Fixed layout sensor snapshot & fast encoders
+
+    SnapshotLayout precompiles, once per sensor dict (eg JUNTEK_R50_DICT):
+      - the field order and number of decimals of each sensor
+      - a JSON %-template with the quoted keys, eg '{"current":%.2f,"voltage":%.2f,...,"time":"%s"}'
+      - a struct for the binary form: uint32 time + int32 (int64 for Wh) per sensor scaled by 10**decimals
+    A Snapshot is then just a list of values in that order plus the epoch time.
+"""
+
+import time
+import json
+import struct
+
+from .iround import iround
+
+# decimals per factor, same as iround_sensor()
+FACTOR_DECIMALS = {
+    'int':   0,
+    'uint':  0,
+    'f-100': 1,
+    'f10':   1,
+    'f100':  2,
+    'f1000': 3,
+}
+
+# value used for missing sensors in the binary form
+SNAPSHOT_NULL = -2**31
+
+class SnapshotLayout:
+    """ precompiled field layout & templates for a sensor dict """
+
+    def __init__(self, sensor_dict: dict):
+        self.names = tuple(name for name, value in sensor_dict.items() if value['factor'] != 'tm')
+        self.index = {name: idx for idx, name in enumerate(self.names)}
+        self.decimals = tuple(FACTOR_DECIMALS.get(sensor_dict[name]['factor'], 3) for name in self.names)
+        self.scales = tuple(10 ** decimals for decimals in self.decimals)
+        self.json_template = "{" + ",".join(json.dumps(name) + ":%." + str(decimals) + "f"
+                                            for name, decimals in zip(self.names, self.decimals)) + ',"time":"%s"}'
+        self.json_keys = tuple('"' + name + '":' for name in self.names)
+        self.struct = struct.Struct("<I" + "".join('q' if sensor_dict[name]['unit'] == 'Wh' else 'i' for name in self.names))
+        self._time_second = None
+        self._time_string = ""
+
+    def time_string(self, timestamp: float) -> str:
+        """ return '%FT%T%z' of timestamp, cached per second """
+        second = int(timestamp)
+        if second != self._time_second:
+            self._time_string = time.strftime('%FT%T%z', time.localtime(second))
+            self._time_second = second
+        return self._time_string
+
+    def from_bytes(self, data: bytes) -> 'Snapshot':
+        """ decode Snapshot.to_bytes() """
+        timestamp, *ints = self.struct.unpack(data)
+        values = [None if value == SNAPSHOT_NULL else value / scale for value, scale in zip(ints, self.scales)]
+        return Snapshot(self, values, timestamp)
+
+
+class Snapshot:
+    """ sensor values in SnapshotLayout order, None if missing """
+    __slots__ = ('layout', 'values', 'time')
+
+    def __init__(self, layout: SnapshotLayout, values: list, timestamp: float):
+        self.layout = layout
+        self.values = values
+        self.time = timestamp
+
+    def get(self, name: str):
+        """ return raw value of sensor """
+        return self.values[self.layout.index[name]]
+
+    def as_dict(self) -> dict:
+        """ return {name: rounded value, ..., 'time': str}, same as JuntekKG.get_sensors() """
+        result = {name: iround(value, decimals)
+                  for name, value, decimals in zip(self.layout.names, self.values, self.layout.decimals)
+                  if value is not None}
+        result['time'] = self.layout.time_string(self.time)
+        return result
+
+    def to_json(self) -> str:
+        """ return compact JSON via the precompiled template """
+        layout = self.layout
+        if None not in self.values:
+            return layout.json_template % (*self.values, layout.time_string(self.time))
+        # slow path: missing sensors are left out
+        parts = [key + "%.*f" % (decimals, value)
+                 for key, value, decimals in zip(layout.json_keys, self.values, layout.decimals)
+                 if value is not None]
+        parts.append('"time":"' + layout.time_string(self.time) + '"')
+        return "{" + ",".join(parts) + "}"
+
+    def to_bytes(self) -> bytes:
+        """ return compact binary form, see SnapshotLayout.from_bytes() """
+        ints = [SNAPSHOT_NULL if value is None else round(value * scale)
+                for value, scale in zip(self.values, self.layout.scales)]
+        return self.layout.struct.pack(int(self.time), *ints)